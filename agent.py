@@ -5,52 +5,217 @@ Generates optimal code based on topics using GitHub Models
 """
 
 import os
+import re
+import ast
 import sys
 import json
-import argparse
-from datetime import datetime
+import time
+import array
+import asyncio
+import logging
+import hashlib
+import operator
+import sqlite3
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
 from pathlib import Path
+from typing import Any, List, Optional
 
+# openai (with httpx/pydantic) and argparse are imported where they are used,
+# so importing this module or running --help stays fast
+
+# Optional JSON speedups: msgspec, then orjson, then the standard library
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
 try:
-    from openai import OpenAI
+    import orjson
 except ImportError:
-    print("Error: openai package not installed. Run: pip install openai")
-    sys.exit(1)
+    orjson = None
 
+if msgspec is not None:
+    _dumps = msgspec.json.Encoder().encode
+elif orjson is not None:
+    _dumps = orjson.dumps
+else:
+    def _dumps(obj):
+        return json.dumps(obj, separators=(",", ":")).encode()
 
-class AICodeAgent:
-    """Autonomous AI Code Generator"""
+_loads = orjson.loads if orjson is not None else json.loads
+
+if msgspec is not None:
+    class FusedResponse(msgspec.Struct):
+        """One generated result from the fused or batched JSON prompt"""
+        code: str
+        reasoning: Any = ""
+        requirements: Any = None
+        language: Optional[str] = None
+        topic: Optional[str] = None
     
-    def __init__(self, api_key=None):
-        """Initialize the agent with GitHub Models API key"""
-        self.api_key = api_key or os.getenv("AI_AGENT_MODEL_API_KEY")
-        if not self.api_key:
-            raise ValueError(
-                "AI_AGENT_MODEL_API_KEY environment variable not set. "
-                "Set it to your GitHub Models API key."
-            )
-        
-        self.client = OpenAI(
-            api_key=self.api_key,
-            base_url="https://models.inference.ai.azure.com"  # GitHub Models endpoint
-        )
-        self.log_buffer = []
+    class BatchResponse(msgspec.Struct):
+        results: List[FusedResponse] = []
     
-    def log(self, level, message):
-        """Log a message with timestamp"""
-        timestamp = datetime.now().isoformat()
-        log_msg = f"[{timestamp}] [{level}] {message}"
-        print(log_msg)
-        self.log_buffer.append(log_msg)
+    _fused_decoder = msgspec.json.Decoder(FusedResponse)
+    _batch_decoder = msgspec.json.Decoder(BatchResponse)
     
-    def reasoning_step(self, topic):
-        """Step 1: Parse topic and create reasoning"""
-        self.log("SENSE", f"Reading topic: {topic}")
-        
-        # Use reasoning prompt
-        reasoning_prompt = f"""Analyze this topic and provide structured reasoning:
+    def _parse_fused(text):
+        """Decode a fused reply straight into typed fields"""
+        return msgspec.structs.asdict(_fused_decoder.decode(text))
+    
+    def _parse_batch(text):
+        """Decode a batched reply into one dict per topic"""
+        return [msgspec.structs.asdict(result) for result in _batch_decoder.decode(text).results]
+else:
+    def _parse_fused(text):
+        """Decode a fused reply"""
+        return _loads(text)
+    
+    def _parse_batch(text):
+        """Decode a batched reply into one dict per topic"""
+        return _loads(text).get("results", [])
+
+
+GITHUB_MODELS_ENDPOINT = "https://models.inference.ai.azure.com"
+CHAT_MODEL = "gpt-4o"
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+CACHE_DIR = Path(os.getenv("AI_AGENT_CACHE_DIR", Path.home() / ".cache" / "ai-coding-agent"))
+# Bump when prompt wording changes so stale completions are not served
+PROMPT_TEMPLATE_VERSION = "4"
+# How long cached completions are served before the model is asked again
+CACHE_TTL = "7d"
+
+# GitHub Models allows ~500 requests/minute; cap the model calls in flight at once
+MAX_CONCURRENT_REQUESTS = 500 // 60
+# Output budget for one --topics-file request and the share each topic needs
+BATCH_MAX_TOKENS = 16000
+BATCH_TOKENS_PER_TOPIC = 4000
+# Topics marshalled into one request; more would squeeze each reply below its share
+MAX_TOPICS_PER_CALL = BATCH_MAX_TOKENS // BATCH_TOKENS_PER_TOPIC
+
+# Code generation budget; topic length says little about program size, so it is fixed
+CODE_MAX_TOKENS = 4000
+# Stop at the blank run models tend to emit between the code and trailing chatter
+CODE_STOP = ["```\n\n\n"]
+
+# Streamed code lands here until its language (and final name) is known
+STREAM_FILENAME = ".main.partial"
+# Flush the partial file each time this many characters of code have arrived (a full reply is ~15k)
+STREAM_FLUSH_CHARS = 2048
+
+# Fallback language sniffing when the model did not report one: a single regex pass
+_PY_RE = re.compile(r"\bimport\s+(?:os|sys)\b|\bdef\s+\w+\s*\(")
+# A markdown fence opening the reply, up to its closing line (usually already cut by CODE_STOP)
+_FENCE_RE = re.compile(r"\A\s*```[\w+.-]*[ \t]*\n(.*?)(?:^```[ \t]*$.*)?\Z", re.S | re.M)
+
 
-Topic: {topic}
+# Prompt templates: static text is built once; calls only splice in the variable parts
+# Sent as the system message of the reasoning, generation, fused and batched calls.
+# OpenAI and Azure OpenAI reuse an identical prompt prefix automatically once it is at
+# least 1024 tokens, so this text stays above that (about 1.4k tokens) and never varies
+# between calls. The 5-token language call and the short requirements call go without it.
+_AGENT_GUIDE = """You are the code generator of an autonomous coding agent. A user opens an issue
+with a short topic such as "Build a weather CLI" and you turn it into one complete program. Nobody
+reviews or edits your answer before it runs: it is saved to disk and executed automatically, so it
+must be correct, self-contained and runnable exactly as written.
+
+How your output is used:
+- Python code is saved as main.py, JavaScript code as main.js, in an otherwise empty directory.
+- For Python, a requirements.txt is written next to it and installed with "pip install -r
+  requirements.txt" before the program runs.
+- The program is then started once with "python main.py" or "node main.js", with no command-line
+  arguments, from inside that directory.
+- It runs on a fresh Linux CI runner under a job timeout of a few minutes. There is no terminal,
+  no standard input, no display and no browser, and no secrets or API keys are configured.
+- Whatever the program prints to stdout and stderr becomes the execution log shown to the user,
+  and a non-zero exit status marks the run as failed.
+
+Runtime rules that follow from this:
+- The program must terminate on its own. Servers, bots, games and other long-running or
+  interactive programs must still do a short, finite demonstration by default (serve or simulate
+  a few requests, play one scripted round, process sample data) and exit cleanly. Offer the
+  interactive or long-running mode behind a command-line flag and document it.
+- Never block on input(), prompts or readline without a non-interactive default.
+- Anything that needs credentials or a network service must work without them: read keys from
+  environment variables, say which ones in the docstring, and fall back to bundled sample data or
+  a clear, friendly message instead of crashing when they are missing.
+- Create any files the program needs (sample data, databases, output) itself, inside its own
+  directory or a temporary directory. Do not assume files exist and do not write elsewhere.
+- Network access may be slow or unavailable; use timeouts on every request and handle failures.
+
+Program structure:
+- One file. Start with a module docstring (Python) or a header comment (JavaScript) that states
+  what the program does, how the code is organised, how to install dependencies, how to run it,
+  every command-line option and environment variable, and an example of the expected output.
+- Keep the code modular: small, single-purpose functions or classes, configuration constants at
+  the top, and a main() entry point guarded by if __name__ == "__main__": in Python or
+  require.main === module in JavaScript.
+- Comment the architecture and any non-obvious logic; do not narrate every line.
+- Print clear, readable progress and results so the execution log shows the program working.
+- Be creative where the topic allows: a useful extra feature, a helpful summary, tidy formatting.
+  Never trade correctness or robustness for it.
+
+Python conventions:
+- Target Python 3.9 and later. Use type hints, f-strings, pathlib, dataclasses and argparse where
+  they fit, and follow PEP 8 naming.
+- Prefer the standard library. Add a third-party package only when it is clearly better for the
+  topic, and only popular, stable, pure-pip packages that install without system libraries.
+- Every import must be used, and every third-party import must correspond to a package that would
+  be listed in requirements.txt.
+- Exit with sys.exit(main()) returning 0 on success and a non-zero status on failure.
+
+JavaScript conventions:
+- Target Node.js 18 or later, using CommonJS require() and only Node's built-in modules (fs,
+  path, http, https, crypto, readline, events, child_process, ...). No package.json is written,
+  so npm packages would not be installed.
+- Use const and let, async/await for asynchronous work, and the built-in fetch for HTTP.
+- Catch rejected promises, report errors on stderr and set process.exitCode on failure.
+
+Error handling:
+- Validate inputs and configuration early and fail with a specific, actionable message.
+- Catch expected failures (missing files, bad data, network errors, missing keys) where they can
+  be handled, and let the top level report anything unexpected with a short message and a
+  non-zero exit status rather than a bare traceback.
+- Never swallow exceptions silently and never leave resources open; use context managers or
+  finally blocks.
+
+Output and self-checks:
+- Print a short heading when the program starts, the main results in a readable form (aligned
+  tables, numbered lists or indented JSON), and a one-line summary at the end.
+- Keep the log concise: no progress bars, ANSI colours or screen clearing, since output is
+  captured to a file, and no more than a few hundred lines for the default demonstration.
+- Where it is cheap, check the program's own results (for example compare a computed value with
+  a known answer or re-read a file that was just written) and report the check in the log.
+- Make the default run deterministic: seed random number generators and avoid output that depends
+  on the current time unless the topic needs it.
+
+Dependencies and requirements:
+- A requirements.txt lists one package per line as name==version, pinned to a recent stable
+  release, and only packages the code imports. If the code uses only the standard library it is
+  exactly: # No external dependencies
+- Do not list standard library modules, and use the PyPI distribution name (for example
+  beautifulsoup4 for bs4, Pillow for PIL, PyYAML for yaml).
+
+Safety:
+- No destructive operations outside the program's own directory, no shell injection, no
+  disabling of TLS verification, no hard-coded credentials, and no code that tries to escape the
+  CI sandbox or hide what it does.
+
+Answer format:
+- Reply in exactly the format the request asks for, with nothing before or after it.
+- When asked for code: only the code, with no markdown fences and no explanation around it.
+- When asked for JSON: a single JSON object with exactly the requested keys; put code in its
+  field as a plain string without fences.
+- When asked for an analysis: be concrete about the language, features, structure,
+  dependencies and scope you will actually use, so the code step can follow it."""
+
+_REASONING_HEAD = """Analyze this topic and provide structured reasoning:
+
+Topic: """
+_REASONING_TAIL = """
 
 Provide:
 1. Language (Python/JavaScript/Bash/etc)
@@ -62,27 +227,24 @@ Provide:
 
 Format as JSON."""
 
-        response = self.client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": reasoning_prompt}],
-            temperature=0.5,
-            max_tokens=1000
-        )
-        
-        reasoning = response.choices[0].message.content
-        self.log("REASON", f"Analysis complete:\n{reasoning}")
-        return reasoning
-    
-    def generate_code_step(self, topic, reasoning):
-        """Step 2: Generate optimal code"""
-        self.log("ACT-GENERATE", "Starting code generation...")
-        
-        generation_prompt = f"""Based on this topic and reasoning, generate complete, production-ready code:
+_LANGUAGE_HEAD = """Which programming language best fits this topic?
+
+Topic: """
+_LANGUAGE_TAIL = """
 
-Topic: {topic}
+Reply with ONE lowercase word only (python, javascript, bash, ...)."""
+
+_GENERATION_HEAD = """Based on this topic and reasoning, generate complete, production-ready code:
+
+Topic: """
+_GENERATION_LANGUAGE = """
+
+Language: """
+_GENERATION_MID = """
 
 Reasoning/Analysis:
-{reasoning}
+"""
+_GENERATION_TAIL = """
 
 Requirements:
 - Complete, working code (not snippets)
@@ -100,25 +262,18 @@ Generate the full code. Include:
 
 Output ONLY the code, ready to run."""
 
-        response = self.client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": generation_prompt}],
-            temperature=0.7,
-            max_tokens=4000
-        )
-        
-        code = response.choices[0].message.content
-        self.log("ACT-GENERATE", f"Generated code ({len(code)} chars)")
-        return code
-    
-    def generate_requirements(self, topic, code):
-        """Step 3: Generate requirements.txt if Python"""
-        req_prompt = f"""Given this topic and code, what Python packages are needed?
+_REQUIREMENTS_HEAD = """Given this topic and code, what Python packages are needed?
 
-Topic: {topic}
+Topic: """
+_REQUIREMENTS_MID = """
 
 Code snippet:
-{code[:500]}...
+"""
+_REQUIREMENTS_IMPORTS_MID = """
+
+Imported top-level modules (map each to its PyPI package, skip the standard library):
+"""
+_REQUIREMENTS_TAIL = """
 
 List ONLY package names and versions (one per line), like:
 requests==2.28.1
@@ -126,119 +281,989 @@ numpy==1.23.0
 
 If no external packages needed, return: # No external dependencies"""
 
-        response = self.client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": req_prompt}],
-            temperature=0.3,
-            max_tokens=500
+_RESULT_KEYS = """- "language": the programming language, one lowercase word (python, javascript, ...)
+- "reasoning": structured analysis (language, core features, architecture, dependencies, scope)
+- "code": the complete, working script (not snippets) with error handling, comments and
+  setup/run instructions in its docstring. Code only, no markdown fences.
+- "requirements": pip-format lines (package==version, one per line) for a Python script,
+  or "# No external dependencies"
+"""
+
+_FUSED_HEAD = """Analyze this topic, then generate complete, production-ready code for it.
+
+Topic: """
+_FUSED_TAIL = """
+
+Return a JSON object with exactly these keys:
+""" + _RESULT_KEYS
+
+_BATCH_HEAD = "For each of the following "
+_BATCH_MID = """ topics, analyze it and generate complete, production-ready code.
+
+Topics:
+"""
+_BATCH_TAIL = """
+
+Return a JSON object {"results": [...]} where element i answers topic i and has exactly these keys:
+- "topic": the topic text
+""" + _RESULT_KEYS
+
+
+# Most recent log lines kept for the result payload
+LOG_BUFFER_SIZE = 1024
+
+logger = logging.getLogger("agent")
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+_ts_second = None
+_ts_prefix = ""
+
+
+def _timestamp():
+    """Local timestamp in datetime.isoformat() layout, without building a datetime
+    
+    The seconds part is rendered by strftime at most once per second.
+    """
+    global _ts_second, _ts_prefix
+    now_us = time.time_ns() // 1000
+    second, micros = divmod(now_us, 1_000_000)
+    if second != _ts_second:
+        _ts_second = second
+        _ts_prefix = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(second))
+    return f"{_ts_prefix}.{micros:06d}"
+
+
+def _slugify(topic):
+    """Turn a topic into a directory-safe name"""
+    slug = re.sub(r"[^a-z0-9]+", "-", topic.lower()).strip("-")
+    return slug[:60] or "topic"
+
+
+def _topic_dirs(topics, output_dir):
+    """One distinct subdirectory per topic; colliding slugs get a numeric suffix"""
+    dirs, seen = [], set()
+    for topic in topics:
+        slug = base = _slugify(topic)
+        n = 2
+        while slug in seen:
+            slug = f"{base}-{n}"
+            n += 1
+        seen.add(slug)
+        dirs.append(Path(output_dir) / slug)
+    return dirs
+
+
+# Python 3.10+; on older interpreters every import is treated as external
+_STDLIB_MODULES = getattr(sys, "stdlib_module_names", frozenset()) | {"__future__"}
+
+
+def _strip_fence(code):
+    """Drop one markdown fence wrapped around code, so it parses and runs as saved"""
+    match = _FENCE_RE.match(code)
+    return match.group(1).rstrip() + "\n" if match else code
+
+
+def _same_topic(returned, requested):
+    """Whether a topic echoed back by the model names the requested one"""
+    def normalise(topic):
+        return " ".join(re.sub(r"\W+", " ", str(topic or "").casefold()).split())
+    return normalise(returned) == normalise(requested)
+
+
+def _check_fused(text):
+    """Raise ValueError unless text is a fused reply carrying code"""
+    result = _parse_fused(text)
+    if not isinstance(result, dict) or not isinstance(result.get("code"), str):
+        raise ValueError("Reply has no \"code\" field")
+
+
+def _batch_checker(topics):
+    """Build a check that raises ValueError unless a batched reply answers exactly these topics"""
+    def check(text):
+        results = _parse_batch(text)
+        if len(results) != len(topics):
+            raise ValueError(f"Expected {len(topics)} results, model returned {len(results)}")
+        for topic, result in zip(topics, results):
+            if not isinstance(result.get("code"), str) or not _same_topic(result.get("topic"), topic):
+                raise ValueError(f"Result for {topic!r} is missing or answers another topic")
+    return check
+
+
+def _imported_modules(code):
+    """Sorted top-level module names imported by code, or None if it does not parse"""
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.add(node.module.split(".")[0])
+    return sorted(names)
+
+
+def _is_python(code, language=None, modules=None):
+    """Whether code is Python; the model's stated language only counts when the code agrees
+    
+    The regex decides most cases. Only when it misses and the model said
+    Python is the code parsed; pass modules (from _imported_modules) when
+    it has already been parsed.
+    """
+    if _PY_RE.search(code):
+        return True
+    if language and "python" in language:
+        # Taken at its word when the code parses: a script need not import os/sys or define functions
+        return (modules if modules is not None else _imported_modules(code)) is not None
+    return False
+
+
+def _http_options():
+    """Keep-alive pool settings shared by the sync and async HTTP clients
+    
+    One pooled connection serves every call instead of a TLS handshake each.
+    """
+    import httpx
+    try:
+        import h2  # noqa: F401 - lets httpx negotiate HTTP/2
+        http2 = True
+    except ImportError:
+        http2 = False
+    return {
+        "http2": http2,
+        "limits": httpx.Limits(max_keepalive_connections=20, keepalive_expiry=60),
+        "timeout": httpx.Timeout(600.0, connect=5.0),
+    }
+
+
+def _parse_ttl(ttl):
+    """Convert a TTL like '7d', '12h' or 3600 into seconds"""
+    if isinstance(ttl, (int, float)):
+        return float(ttl)
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    return float(ttl[:-1]) * units[ttl[-1]]
+
+
+class SemanticCache:
+    """SQLite-backed completion cache matched by prompt embedding similarity"""
+    
+    def __init__(self, path=None, threshold=0.85, ttl=CACHE_TTL, version=PROMPT_TEMPLATE_VERSION):
+        self.path = Path(path or CACHE_DIR / "semantic.db")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.threshold = threshold
+        self.db = sqlite3.connect(self.path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, model TEXT, version TEXT, namespace TEXT, "
+            "embedding BLOB, response TEXT, created_at REAL)"
+        )
+        self.prune(_parse_ttl(ttl), version)
+    
+    def prune(self, ttl, version):
+        """Delete rows that are expired or belong to another template version"""
+        self.db.execute(
+            "DELETE FROM completions WHERE created_at < ? OR version != ?",
+            (time.time() - ttl, version)
+        )
+        self.db.commit()
+    
+    @staticmethod
+    def _hash(model, prompt, version):
+        return hashlib.md5(f"{version}|{model}|{prompt}".encode()).hexdigest()
+    
+    def get_exact(self, model, prompt, ttl, version):
+        """Return the stored completion for an identical prompt, if fresh"""
+        row = self.db.execute(
+            "SELECT response FROM completions WHERE key = ? AND created_at >= ?",
+            (self._hash(model, prompt, version), time.time() - ttl)
+        ).fetchone()
+        return row[0] if row else None
+    
+    def get_similar(self, model, namespace, embedding, ttl, version):
+        """Return (similarity, completion) for the closest fresh entry above threshold"""
+        best, best_response = self.threshold, None
+        rows = self.db.execute(
+            "SELECT embedding, response FROM completions "
+            "WHERE model = ? AND version = ? AND namespace = ? AND created_at >= ?",
+            (model, version, namespace, time.time() - ttl)
+        )
+        for blob, response in rows:
+            # Embeddings are stored unit-length, so the dot product is the cosine
+            similarity = sum(map(operator.mul, embedding, array.array("f", blob)))
+            if similarity >= best:
+                best, best_response = similarity, response
+        return (best, best_response) if best_response is not None else (None, None)
+    
+    def set(self, model, prompt, namespace, embedding, response, version):
+        """Store a completion with its (unit-length) semantic key embedding"""
+        self.db.execute(
+            "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self._hash(model, prompt, version), model, version, namespace,
+             array.array("f", embedding).tobytes(), response, time.time())
+        )
+        self.db.commit()
+    
+    def close(self):
+        self.db.close()
+
+
+class PromptLRU:
+    """In-memory LRU of completions for identical prompts within one run
+    
+    Not persisted: the disk cache below it already keeps completions
+    between runs, with an expiry.
+    """
+    
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+    
+    @staticmethod
+    def key(model, prompt, temperature):
+        return (PROMPT_TEMPLATE_VERSION, model, hashlib.blake2b(prompt.encode()).digest(), temperature)
+    
+    def get(self, key):
+        try:
+            self.entries.move_to_end(key)
+        except KeyError:
+            return None
+        return self.entries[key]
+    
+    def set(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+class DiskCache:
+    """Exact-request response cache, one small JSON file per request hash"""
+    
+    def __init__(self, path=None, ttl=CACHE_TTL):
+        self.path = Path(path or CACHE_DIR / "responses")
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.ttl = _parse_ttl(ttl)
+        self.locks = {}
+        self.prune()
+    
+    def prune(self):
+        """Delete response files older than the TTL"""
+        cutoff = time.time() - self.ttl
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                try:
+                    if entry.name.endswith(".json") and entry.stat().st_mtime < cutoff:
+                        os.unlink(entry.path)
+                except OSError:
+                    pass
+    
+    @staticmethod
+    def key(model, prompt, temperature, max_tokens):
+        header = f"{PROMPT_TEMPLATE_VERSION}|{model}|{temperature}|{max_tokens}|".encode()
+        return hashlib.blake2b(header + prompt.encode(), digest_size=16).hexdigest()
+    
+    def get(self, key):
+        path = self.path / f"{key}.json"
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl:
+                path.unlink()
+                return None
+            return _loads(path.read_bytes())["content"]
+        except (OSError, ValueError, KeyError):
+            return None
+    
+    def set(self, key, content):
+        path = self.path / f"{key}.json"
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(_dumps({"content": content}))
+        os.replace(tmp, path)
+
+
+def disk_cached(func):
+    """Serve exact repeats of a request from the agent's DiskCache
+    
+    Concurrent identical requests wait on a per-key lock so only the first
+    reaches the next layer; the rest read its result from disk.
+    """
+    @functools.wraps(func)
+    async def wrapper(self, prompt, **kwargs):
+        disk = self.disk_cache
+        if disk is None:
+            return await func(self, prompt, **kwargs)
+        
+        key = disk.key(kwargs.get("model", CHAT_MODEL), prompt, kwargs["temperature"], kwargs["max_tokens"])
+        lock = disk.locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                cached = None if self.refresh else disk.get(key)
+                if cached is not None:
+                    self.log("CACHE", "On-disk prompt match")
+                    return cached, "stop"
+                
+                response, finish_reason = await func(self, prompt, **kwargs)
+                if finish_reason == "stop":
+                    disk.set(key, response)
+                return response, finish_reason
+        finally:
+            if not lock.locked():
+                disk.locks.pop(key, None)
+    return wrapper
+
+
+def prompt_lru(func):
+    """Return completions for byte-identical prompts without any lookup or call"""
+    @functools.wraps(func)
+    async def wrapper(self, prompt, **kwargs):
+        lru = self.prompt_lru
+        if lru is None:
+            return await func(self, prompt, **kwargs)
+        
+        key = lru.key(kwargs.get("model", CHAT_MODEL), prompt, kwargs["temperature"])
+        cached = None if self.refresh else lru.get(key)
+        if cached is not None:
+            self.log("CACHE", "In-memory prompt match")
+            return cached, "stop"
+        
+        response, finish_reason = await func(self, prompt, **kwargs)
+        if finish_reason == "stop":
+            lru.set(key, response)
+        return response, finish_reason
+    return wrapper
+
+
+def cached_llm(ttl=CACHE_TTL, template_version=PROMPT_TEMPLATE_VERSION):
+    """Serve a completion method from the agent's SemanticCache when possible
+    
+    Lookup order: MD5 exact match on the full prompt, then embedding
+    similarity of ``semantic_key`` within ``namespace``, then the wrapped
+    call (whose result is stored for next time if it finished normally).
+    Only the variable part of a prompt is embedded, since the shared
+    template would otherwise make unrelated topics look alike. Calls
+    without a ``semantic_key`` skip this layer and rely on the exact-match
+    disk cache below it.
+    """
+    ttl_seconds = _parse_ttl(ttl)
+    
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, prompt, *, namespace=None, semantic_key=None, **kwargs):
+            cache = self.cache
+            if cache is None or semantic_key is None:
+                return await func(self, prompt, **kwargs)
+            
+            model = kwargs.get("model", CHAT_MODEL)
+            cached = None if self.refresh else cache.get_exact(model, prompt, ttl_seconds, template_version)
+            if cached is not None:
+                self.log("CACHE", "Exact prompt match")
+                return cached, "stop"
+            
+            try:
+                embedding = await self._embed(semantic_key)
+            except Exception as e:
+                self.log("CACHE", f"Embedding failed, skipping semantic cache: {e}")
+                return await func(self, prompt, **kwargs)
+            
+            if not self.refresh:
+                similarity, cached = cache.get_similar(model, namespace, embedding, ttl_seconds, template_version)
+                if cached is not None:
+                    self.log("CACHE", f"Semantic match (similarity {similarity:.2f})")
+                    return cached, "stop"
+            
+            response, finish_reason = await func(self, prompt, **kwargs)
+            if finish_reason == "stop":
+                cache.set(model, prompt, namespace, embedding, response, template_version)
+            return response, finish_reason
+        return wrapper
+    return decorator
+
+
+class AICodeAgent:
+    """Autonomous AI Code Generator"""
+    
+    def __init__(self, api_key=None, cache=True, refresh=False):
+        """Initialize the agent with GitHub Models API key
+        
+        refresh skips cache lookups but still stores the new completions.
+        """
+        self.api_key = api_key or os.getenv("AI_AGENT_MODEL_API_KEY")
+        if not self.api_key:
+            raise ValueError(
+                "AI_AGENT_MODEL_API_KEY environment variable not set. "
+                "Set it to your GitHub Models API key."
+            )
+        
+        try:
+            import httpx
+            from openai import OpenAI
+        except ImportError:
+            raise ImportError("openai package not installed. Run: pip install openai") from None
+        
+        self.client = OpenAI(
+            api_key=self.api_key,
+            base_url=GITHUB_MODELS_ENDPOINT,  # GitHub Models endpoint
+            http_client=httpx.Client(**_http_options())
+        )
+        self.aclient = self._async_client()
+        self._requests = None
+        self._embeddings = {}
+        self._embedding_calls = {}
+        self.refresh = refresh
+        self.log_buffer = deque(maxlen=LOG_BUFFER_SIZE)
+        self.prompt_lru = PromptLRU(maxsize=1024) if cache else None
+        # The on-disk layers are only an optimisation: run without them if CACHE_DIR is unusable
+        self.cache = self._open_cache(SemanticCache, threshold=0.85) if cache else None
+        self.disk_cache = self._open_cache(DiskCache) if cache else None
+    
+    def _open_cache(self, factory, **kwargs):
+        """Open an on-disk cache layer, or log why it is skipped and return None"""
+        try:
+            return factory(**kwargs)
+        except (OSError, sqlite3.Error) as e:
+            self.log("CACHE", f"{factory.__name__} disabled, cannot use {CACHE_DIR}: {e}")
+            return None
+    
+    def _async_client(self):
+        """Build the AsyncOpenAI client and its connection pool"""
+        import httpx
+        from openai import AsyncOpenAI
+        
+        return AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=GITHUB_MODELS_ENDPOINT,
+            http_client=httpx.AsyncClient(**_http_options())
+        )
+    
+    def close(self):
+        """Close the sync connection pool and the cache database"""
+        self.client.close()
+        if self.cache is not None:
+            self.cache.close()
+    
+    async def aclose(self):
+        """Close both connection pools and the cache database"""
+        await self.aclient.close()
+        self.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+    
+    def log(self, level, message):
+        """Log a message with timestamp"""
+        log_msg = f"[{_timestamp()}] [{level}] {message}"
+        logger.info(log_msg)
+        self.log_buffer.append(log_msg)
+    
+    def _request_slots(self):
+        """Semaphore bounding concurrent model calls, created on the running loop"""
+        if self._requests is None:
+            self._requests = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        return self._requests
+    
+    async def _embed(self, text):
+        """Return the unit-length embedding of text, fetching each distinct text once"""
+        vector = self._embeddings.get(text)
+        if vector is not None:
+            return vector
+        # Repeated topics in one batch embed the same key concurrently; share the call
+        call = self._embedding_calls.get(text)
+        if call is None:
+            call = self._embedding_calls[text] = asyncio.ensure_future(self._fetch_embedding(text))
+            call.add_done_callback(lambda _: self._embedding_calls.pop(text, None))
+        vector = self._embeddings[text] = await call
+        return vector
+    
+    async def _fetch_embedding(self, text):
+        async with self._request_slots():
+            response = await self.aclient.embeddings.create(model=EMBEDDING_MODEL, input=text)
+        vector = response.data[0].embedding
+        norm = sum(v * v for v in vector) ** 0.5 or 1.0
+        return [v / norm for v in vector]
+    
+    @prompt_lru
+    @disk_cached
+    @cached_llm(ttl=CACHE_TTL, template_version=PROMPT_TEMPLATE_VERSION)
+    async def _complete(self, prompt, *, temperature, max_tokens, model=CHAT_MODEL,
+                        response_format=None, stop=None, on_delta=None, validate=None, system=None):
+        """Send a single-turn chat completion and return (text, finish_reason)
+        
+        system, when given, is sent as the system message ahead of the prompt.
+        With on_delta the completion is streamed and each text chunk is passed
+        to it as it arrives (cache hits return without calling it). Only
+        replies that finish with "stop" are cached; cache hits report "stop".
+        validate is called on a finished reply and should raise if it is
+        unusable; the reply is then returned with finish_reason "invalid",
+        so no cache layer stores it.
+        """
+        messages = [{"role": "user", "content": prompt}]
+        if system:
+            messages.insert(0, {"role": "system", "content": system})
+        options = {}
+        if response_format:
+            options["response_format"] = response_format
+        if stop:
+            options["stop"] = stop
+        # Hold the slot until a streamed reply has been fully read
+        async with self._request_slots():
+            response = await self.aclient.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=on_delta is not None,
+                **options
+            )
+            if on_delta is None:
+                choice = response.choices[0]
+                content, finish_reason = choice.message.content, choice.finish_reason
+            else:
+                parts = []
+                finish_reason = None
+                async for chunk in response:
+                    # Azure sends a leading chunk without choices (content filter results)
+                    if not chunk.choices:
+                        continue
+                    choice = chunk.choices[0]
+                    if choice.delta.content:
+                        parts.append(choice.delta.content)
+                        on_delta(choice.delta.content)
+                    finish_reason = choice.finish_reason or finish_reason
+                content = "".join(parts)
+        if finish_reason == "length":
+            self.log("WARNING", f"Reply hit max_tokens={max_tokens} and is truncated; it will not be cached")
+        elif finish_reason == "stop" and validate is not None:
+            try:
+                validate(content)
+            except Exception as e:
+                self.log("WARNING", f"Reply rejected, it will not be cached: {e}")
+                finish_reason = "invalid"
+        return content, finish_reason
+    
+    async def reasoning_step(self, topic):
+        """Step 1: Parse topic and create reasoning"""
+        self.log("SENSE", f"Reading topic: {topic}")
+        
+        reasoning_prompt = _REASONING_HEAD + topic + _REASONING_TAIL
+        
+        reasoning, _ = await self._complete(
+            reasoning_prompt, temperature=0.0, max_tokens=1000, system=_AGENT_GUIDE,
+            namespace="reasoning", semantic_key=topic
         )
+        self.log("REASON", f"Analysis complete:\n{reasoning}")
+        return reasoning
+    
+    async def detect_language_step(self, topic):
+        """Step 1b: Classify the target language (runs alongside reasoning)"""
+        language_prompt = _LANGUAGE_HEAD + topic + _LANGUAGE_TAIL
         
-        requirements = response.choices[0].message.content
+        language, _ = await self._complete(
+            language_prompt, temperature=0, max_tokens=5
+        )
+        language = language.strip().lower()
+        self.log("REASON", f"Detected language: {language}")
+        return language
+    
+    async def generate_code_step(self, topic, reasoning, output_dir="generated-code", language=None):
+        """Step 2: Generate optimal code, streaming it to disk as it arrives
+        
+        language (from detect_language_step) is written into the prompt so the
+        code and the saved file name agree. Returns the code and the partial
+        file it was written to; the file is renamed into place when the files
+        are saved.
+        """
+        self.log("ACT-GENERATE", "Starting code generation...")
+        
+        if language:
+            generation_prompt = (_GENERATION_HEAD + topic + _GENERATION_LANGUAGE + language
+                                 + _GENERATION_MID + reasoning + _GENERATION_TAIL)
+        else:
+            generation_prompt = _GENERATION_HEAD + topic + _GENERATION_MID + reasoning + _GENERATION_TAIL
+        
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        streamed_file = output_dir / STREAM_FILENAME
+        
+        try:
+            with open(streamed_file, "w") as f:
+                streamed = False
+                unflushed = 0
+                
+                def write(delta):
+                    nonlocal streamed, unflushed
+                    f.write(delta)
+                    streamed = True
+                    unflushed += len(delta)
+                    if unflushed >= STREAM_FLUSH_CHARS:
+                        f.flush()
+                        unflushed = 0
+                
+                code, _ = await self._complete(
+                    generation_prompt, temperature=0.7, max_tokens=CODE_MAX_TOKENS,
+                    stop=CODE_STOP, system=_AGENT_GUIDE, on_delta=write
+                )
+                stripped = _strip_fence(code)
+                if not streamed:
+                    # Served from cache, nothing was streamed
+                    f.write(stripped)
+                elif stripped != code:
+                    # The model fenced its reply; rewrite the file with the bare code
+                    f.seek(0)
+                    f.truncate()
+                    f.write(stripped)
+                code = stripped
+        except BaseException:
+            # A stream cut off partway (error, timeout, cancellation) leaves no partial file behind
+            streamed_file.unlink(missing_ok=True)
+            raise
+        
+        self.log("ACT-GENERATE", f"Generated code ({len(code)} chars)")
+        return code, streamed_file
+    
+    async def generate_requirements(self, topic, code, modules=None):
+        """Step 3: Generate requirements.txt if Python
+        
+        modules is the _imported_modules result when the caller already has it.
+        """
+        if modules is None:
+            modules = _imported_modules(code)
+        if modules is not None:
+            modules = [name for name in modules if name not in _STDLIB_MODULES]
+            if not modules:
+                self.log("ACT-GENERATE", "Only standard library imports, no requirements needed")
+                return "# No external dependencies"
+        
+        if modules is None:
+            # Unparseable code: fall back to the opening of the script
+            req_prompt = _REQUIREMENTS_HEAD + topic + _REQUIREMENTS_MID + code[:500] + "..." + _REQUIREMENTS_TAIL
+        else:
+            req_prompt = _REQUIREMENTS_HEAD + topic + _REQUIREMENTS_IMPORTS_MID + "\n".join(modules) + _REQUIREMENTS_TAIL
+        
+        requirements, _ = await self._complete(
+            req_prompt, temperature=0.3, max_tokens=500
+        )
         self.log("ACT-GENERATE", "Generated requirements")
         return requirements
     
-    def save_generated_code(self, topic, code, requirements=None):
-        """Save generated code to files"""
-        output_dir = Path("generated-code")
-        output_dir.mkdir(exist_ok=True)
+    async def fused_step(self, topic):
+        """Steps 1-3 in a single round-trip: reasoning, code and requirements as JSON"""
+        self.log("SENSE", f"Reading topic: {topic}")
+        
+        fused_prompt = _FUSED_HEAD + topic + _FUSED_TAIL
+        
+        response, _ = await self._complete(
+            fused_prompt, temperature=0.7, max_tokens=5000,
+            response_format={"type": "json_object"}, validate=_check_fused, system=_AGENT_GUIDE
+        )
+        return self._unpack_generated(_parse_fused(response))
+    
+    async def batched_step(self, topics):
+        """Fused generation for several topics in one request
+        
+        Returns one (language, reasoning, code, requirements) per topic, or a
+        ValueError in its place when the result echoes a different topic.
+        """
+        self.log("SENSE", f"Reading {len(topics)} topics in one request")
+        listing = "\n".join(f"{i}. {topic}" for i, topic in enumerate(topics, 1))
+        
+        batch_prompt = _BATCH_HEAD + str(len(topics)) + _BATCH_MID + listing + _BATCH_TAIL
+        
+        response, _ = await self._complete(
+            batch_prompt, temperature=0.7, max_tokens=min(BATCH_MAX_TOKENS, BATCH_TOKENS_PER_TOPIC * len(topics)),
+            response_format={"type": "json_object"}, validate=_batch_checker(topics),
+            system=_AGENT_GUIDE
+        )
+        results = _parse_batch(response)
+        if len(results) != len(topics):
+            raise ValueError(f"Expected {len(topics)} results, model returned {len(results)}")
+        return [
+            self._unpack_generated(result) if _same_topic(result.get("topic"), topic)
+            else ValueError(f"Result for {topic!r} answers {result.get('topic')!r} instead")
+            for topic, result in zip(topics, results)
+        ]
+    
+    def _unpack_generated(self, result):
+        """Normalise one fused JSON result into (language, reasoning, code, requirements)"""
+        reasoning = result.get("reasoning", "")
+        if not isinstance(reasoning, str):
+            reasoning = json.dumps(reasoning, indent=2)
+        requirements = result.get("requirements") or None
+        if isinstance(requirements, list):
+            requirements = "\n".join(requirements)
         
-        # Detect language and save main file
-        if "import" in code and ("import os" in code or "import sys" in code or "def " in code):
+        self.log("REASON", f"Analysis complete:\n{reasoning}")
+        self.log("ACT-GENERATE", f"Generated code ({len(result['code'])} chars)")
+        language = str(result.get("language") or "").strip().lower() or None
+        return language, reasoning, _strip_fence(result["code"]), requirements
+    
+    def _plan_save(self, topic, code, requirements, output_dir, streamed_file, language, is_python=None):
+        """Decide the output files; returns (output_dir, messages, jobs) with one write job per file"""
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        
+        # Detect language and pick the main file; the code wins over the model's answer
+        if is_python is None:
+            is_python = _is_python(code, language)
+        if language and is_python != ("python" in language):
+            self.log("OBSERVE", f"Model said {language}, but the code looks like "
+                                f"{'python' if is_python else 'another language'}; following the code")
+        if is_python:
             main_file = output_dir / "main.py"
             language = "python"
         else:
             main_file = output_dir / "main.js"
             language = "javascript"
         
-        # Write main code
-        with open(main_file, "w") as f:
-            f.write(code)
-        self.log("OBSERVE", f"Saved code to {main_file}")
+        # Main code: move the streamed file into place, or write it in one go
+        written = [main_file]
+        messages = [f"Saved code to {main_file}"]
+        if streamed_file:
+            jobs = [functools.partial(os.replace, streamed_file, main_file)]
+        else:
+            jobs = [functools.partial(main_file.write_bytes, code.encode())]
         
-        # Write requirements
+        # Requirements
         if requirements and language == "python":
             req_file = output_dir / "requirements.txt"
-            with open(req_file, "w") as f:
-                f.write(requirements)
-            self.log("OBSERVE", f"Saved requirements to {req_file}")
+            jobs.append(functools.partial(req_file.write_bytes, requirements.encode()))
+            written.append(req_file)
+            messages.append(f"Saved requirements to {req_file}")
         
-        # Save metadata
+        # Metadata
         metadata = {
             "topic": topic,
             "language": language,
-            "generated_at": datetime.now().isoformat(),
-            "files": [str(main_file)]
+            "generated_at": _timestamp(),
+            "files": [str(path) for path in written]
         }
-        with open(output_dir / "metadata.json", "w") as f:
-            json.dump(metadata, f, indent=2)
+        jobs.append(functools.partial((output_dir / "metadata.json").write_bytes, _dumps(metadata)))
+        
+        return output_dir, messages, jobs
+    
+    def save_generated_code(self, topic, code, requirements=None, output_dir="generated-code",
+                            streamed_file=None, language=None, is_python=None):
+        """Save generated code to files, writing them concurrently
         
+        If the code was already streamed to streamed_file, that file is moved
+        into place instead of being written again. language is the model's
+        answer when known; it is checked against the code, which wins.
+        is_python skips that check when the caller has already made it.
+        """
+        output_dir, messages, jobs = self._plan_save(
+            topic, code, requirements, output_dir, streamed_file, language, is_python
+        )
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            for future in [pool.submit(job) for job in jobs]:
+                future.result()
+        for message in messages:
+            self.log("OBSERVE", message)
+        return output_dir
+    
+    async def save_generated_code_async(self, topic, code, requirements=None, output_dir="generated-code",
+                                        streamed_file=None, language=None, is_python=None):
+        """Async save_generated_code: the file writes run concurrently in worker threads"""
+        output_dir, messages, jobs = self._plan_save(
+            topic, code, requirements, output_dir, streamed_file, language, is_python
+        )
+        await asyncio.gather(*(asyncio.to_thread(job) for job in jobs))
+        for message in messages:
+            self.log("OBSERVE", message)
         return output_dir
     
-    def generate_full(self, topic):
+    async def generate_full_async(self, topic, output_dir="generated-code", fused=False):
         """Execute full agent workflow"""
         self.log("START", f"Generating code for topic: {topic}")
         
+        streamed_file = is_python = None
         try:
-            # Step 1: Reasoning
-            reasoning = self.reasoning_step(topic)
-            
-            # Step 2: Generate code
-            code = self.generate_code_step(topic, reasoning)
-            
-            # Step 3: Generate requirements (if Python)
-            requirements = None
-            if "python" in reasoning.lower():
-                requirements = self.generate_requirements(topic, code)
+            if fused:
+                # Steps 1-3 in one request
+                language, reasoning, code, requirements = await self.fused_step(topic)
+            else:
+                # Step 1: Reasoning + language detection, issued concurrently
+                reasoning, language = await asyncio.gather(
+                    self.reasoning_step(topic),
+                    self.detect_language_step(topic)
+                )
+                
+                # Step 2: Generate code
+                code, streamed_file = await self.generate_code_step(topic, reasoning, output_dir, language)
+                
+                # Step 3: Generate requirements (if the code is Python); the code is parsed once for both
+                modules = _imported_modules(code)
+                is_python = _is_python(code, language, modules)
+                requirements = None
+                if is_python:
+                    requirements = await self.generate_requirements(topic, code, modules)
             
             # Step 4: Save files
-            output_dir = self.save_generated_code(topic, code, requirements)
-            
-            self.log("SUCCESS", f"Generated code saved to {output_dir}")
-            return {
-                "status": "success",
-                "output_dir": str(output_dir),
-                "logs": "\n".join(self.log_buffer),
-                "files": list(output_dir.glob("*"))
-            }
+            return await self._save_result(topic, code, requirements, output_dir, streamed_file, language, is_python)
         
         except Exception as e:
-            self.log("ERROR", str(e))
-            return {
-                "status": "error",
-                "error": str(e),
-                "logs": "\n".join(self.log_buffer)
-            }
+            if streamed_file and streamed_file.exists():
+                streamed_file.unlink()
+            return self._error_result(e)
+    
+    async def _save_result(self, topic, code, requirements, output_dir, streamed_file=None, language=None,
+                           is_python=None):
+        """Save generated files and build the success payload"""
+        output_dir = await self.save_generated_code_async(
+            topic, code, requirements, output_dir, streamed_file, language, is_python
+        )
+        
+        self.log("SUCCESS", f"Generated code saved to {output_dir}")
+        with os.scandir(output_dir) as entries:
+            files = [entry.path for entry in entries]
+        return {
+            "status": "success",
+            "output_dir": str(output_dir),
+            "logs": "\n".join(self.log_buffer),
+            "files": files
+        }
+    
+    def _error_result(self, error):
+        """Log an error and build the failure payload"""
+        self.log("ERROR", str(error))
+        return {
+            "status": "error",
+            "error": str(error),
+            "logs": "\n".join(self.log_buffer)
+        }
+    
+    def generate_full(self, topic, output_dir="generated-code", fused=False):
+        """Synchronous wrapper around generate_full_async"""
+        async def run():
+            try:
+                return await self.generate_full_async(topic, output_dir, fused)
+            finally:
+                # Pooled async connections are bound to this event loop
+                await self.aclient.close()
+                self.aclient = self._async_client()
+                self._requests = None
+        return asyncio.run(run())
+    
+    async def generate_batch_async(self, topics, output_dir="generated-code", fused=False):
+        """Run the workflow for several topics concurrently, one subdirectory each"""
+        return await asyncio.gather(*(self.generate_full_async(topic, topic_dir, fused)
+                                      for topic, topic_dir in zip(topics, _topic_dirs(topics, output_dir))))
+    
+    async def generate_marshalled_async(self, topics, output_dir="generated-code", batch_size=MAX_TOPICS_PER_CALL):
+        """Generate many topics with batch_size topics marshalled into each model call
+        
+        Topics whose batch fails, or whose result is rejected, are retried
+        one at a time with the fused workflow.
+        """
+        batch_size = max(1, min(batch_size, MAX_TOPICS_PER_CALL))
+        dirs = _topic_dirs(topics, output_dir)
+        chunks = [(topics[i:i + batch_size], dirs[i:i + batch_size]) for i in range(0, len(topics), batch_size)]
+        
+        async def run(chunk, chunk_dirs):
+            try:
+                generated = await self.batched_step(chunk)
+            except Exception as e:
+                generated = [e] * len(chunk)
+            results = []
+            for topic, topic_dir, result in zip(chunk, chunk_dirs, generated):
+                if isinstance(result, Exception):
+                    if len(chunk) > 1:
+                        self.log("ERROR", f"Retrying {topic!r} on its own: {result}")
+                        results.append(await self.generate_full_async(topic, topic_dir, fused=True))
+                    else:
+                        results.append(self._error_result(result))
+                    continue
+                language, _, code, requirements = result
+                try:
+                    results.append(await self._save_result(
+                        topic, code, requirements, topic_dir, language=language
+                    ))
+                except Exception as e:
+                    results.append(self._error_result(e))
+            return results
+        
+        nested = await asyncio.gather(*(run(chunk, chunk_dirs) for chunk, chunk_dirs in chunks))
+        return [result for chunk_results in nested for result in chunk_results]
+
+
+def print_result(result):
+    """Print a generation summary"""
+    print("\n" + "="*60)
+    print("GENERATION COMPLETE")
+    print("="*60)
+    print(f"Status: {result['status'].upper()}")
+    if result['status'] == 'success':
+        print(f"Output: {result['output_dir']}")
+        print(f"Files: {len(result['files'])} generated")
+    else:
+        print(f"Error: {result.get('error', 'Unknown error')}")
+    print("="*60)
+
+
+async def run(agent, args):
+    """Generate every requested topic on one event loop, then release the agent"""
+    async with agent:
+        if args.topics_file:
+            return await agent.generate_marshalled_async(args.topics, args.output, args.batch_size)
+        if len(args.topics) == 1:
+            return [await agent.generate_full_async(args.topics[0], args.output, args.fused)]
+        return await agent.generate_batch_async(args.topics, args.output, args.fused)
 
 
 def main():
     """CLI entry point"""
+    import argparse
+    
     parser = argparse.ArgumentParser(description="AI Coding Agent - Generate code from topics")
-    parser.add_argument("topic", help="Topic for code generation (e.g., 'Build a weather app')")
+    parser.add_argument("topics", nargs="*", metavar="topic",
+                        help="Topic for code generation (e.g., 'Build a weather app'); "
+                             "several topics are generated concurrently")
+    parser.add_argument("--topics-file", help="File with one topic per line, generated several per model call")
+    parser.add_argument("--batch-size", type=int, default=MAX_TOPICS_PER_CALL,
+                        help=f"Topics per model call with --topics-file (max {MAX_TOPICS_PER_CALL})")
     parser.add_argument("--api-key", help="GitHub Models API key (or set AI_AGENT_MODEL_API_KEY env var)")
     parser.add_argument("--output", default="generated-code", help="Output directory")
+    parser.add_argument("--fused", action="store_true",
+                        help="Generate reasoning, code and requirements in a single model call")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always call the model, replacing any cached responses")
     
     args = parser.parse_args()
+    if args.topics_file:
+        try:
+            with open(args.topics_file) as f:
+                args.topics += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+        except OSError as e:
+            parser.error(f"cannot read --topics-file: {e}")
+        if not args.topics:
+            parser.error(f"no topics in {args.topics_file}")
+    elif not args.topics:
+        parser.error("provide a topic or --topics-file")
     
     try:
-        agent = AICodeAgent(api_key=args.api_key)
-        result = agent.generate_full(args.topic)
-        
-        print("\n" + "="*60)
-        print("GENERATION COMPLETE")
-        print("="*60)
-        print(f"Status: {result['status'].upper()}")
-        if result['status'] == 'success':
-            print(f"Output: {result['output_dir']}")
-            print(f"Files: {len(result['files'])} generated")
-        else:
-            print(f"Error: {result.get('error', 'Unknown error')}")
-        print("="*60)
+        agent = AICodeAgent(api_key=args.api_key, refresh=args.no_cache)
+        results = asyncio.run(run(agent, args))
+        
+        for result in results:
+            print_result(result)
         
         # Print logs
         print("\nLogs:")
-        print(result['logs'])
+        print("\n".join(agent.log_buffer))
         
-        return 0 if result['status'] == 'success' else 1
+        return 0 if all(r['status'] == 'success' for r in results) else 1
     
     except Exception as e:
         print(f"Fatal error: {e}", file=sys.stderr)